@@ -2,20 +2,273 @@
 LangChain RAG Agent using local LLM (Ollama)
 Reads from local documents and generates responses
 """
+import asyncio
+import glob
+import math
+import multiprocessing
 import os
+import pickle
+import re
+import threading
+import uuid
+import warnings
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+
+import faiss
+import httpx
+import numpy as np
 
 try:
     import config
 except Exception:
     config = None
 
-from langchain_community.document_loaders import DirectoryLoader, TextLoader, PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.embeddings import OllamaEmbeddings
+from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import DistanceStrategy
 from langchain_community.llms import Ollama
-from langchain.chains import RetrievalQA
+from langchain.embeddings.cache import CacheBackedEmbeddings
 from langchain.prompts import PromptTemplate
+from langchain.storage import LocalFileStore
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.pydantic_v1 import PrivateAttr
+from langchain_core.retrievers import BaseRetriever
+
+
+SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+LIST_NUMBER = re.compile(r'[ \t]*\d+\.')
+
+
+def _sentence_end(text, pos=0):
+    """Match the whitespace after the first complete sentence at or after pos.
+
+    A list number alone at the start of a line, such as "2.", belongs to the
+    sentence after it. Returns None when no complete sentence follows pos.
+    """
+    for match in SENTENCE_END.finditer(text, pos):
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        if not LIST_NUMBER.fullmatch(text, line_start, match.start()):
+            return match
+    return None
+
+
+class QueryError(Exception):
+    """A query failed; the message is meant for the user."""
+
+
+def _load_pdf(path):
+    """Load one PDF. Module-level so it can be sent to worker processes."""
+    from langchain_community.document_loaders import PyPDFLoader
+    return PyPDFLoader(path).load()
+
+
+def _load_text(path):
+    from langchain_community.document_loaders import TextLoader
+    return TextLoader(path).load()
+
+
+class BatchedOllamaEmbeddings(OllamaEmbeddings):
+    """OllamaEmbeddings that embeds documents in batches via /api/embed.
+
+    The legacy /api/embeddings endpoint takes one text per request, so indexing
+    N chunks costs N round-trips. /api/embed accepts a list of inputs and
+    returns all vectors in one response, and up to max_concurrency batches are
+    in flight at once so Ollama can serve them on its parallel slots
+    (OLLAMA_NUM_PARALLEL). embed_query keeps using the legacy endpoint through
+    the parent class, behind an LRU cache so repeated questions skip the call,
+    over one keep-alive HTTP/2 client held for the life of the instance.
+    Each embed_documents call opens its own AsyncClient, since an async
+    client is bound to the event loop asyncio.run creates for that call.
+    """
+
+    batch_size: int = 64
+    """Number of texts sent per /api/embed request."""
+    max_concurrency: int = 8
+    """Number of /api/embed requests in flight at once."""
+    query_cache_size: int = 1024
+    """Number of query embeddings kept in memory."""
+
+    _embed_query_cached = PrivateAttr()
+    _client = PrivateAttr()
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=40, keepalive_expiry=30.0),
+            timeout=300
+        )
+        # Per-instance cache: pydantic models are unhashable, so lru_cache
+        # cannot decorate the method directly.
+        self._embed_query_cached = lru_cache(maxsize=self.query_cache_size)(
+            self._embed_query_uncached
+        )
+
+    def _process_emb_response(self, input):
+        """Embed one text via /api/embeddings on the shared client."""
+        try:
+            res = self._client.post(
+                f"{self.base_url}/api/embeddings",
+                json={"model": self.model, "prompt": input, **self._default_params},
+            )
+        except httpx.HTTPError as e:
+            raise ValueError(f"Error raised by inference endpoint: {e}")
+        if res.status_code != 200:
+            raise ValueError(
+                "Error raised by inference API HTTP code: %s, %s"
+                % (res.status_code, res.text)
+            )
+        return res.json()["embedding"]
+
+    def _embed_query_uncached(self, text):
+        return tuple(super().embed_query(text))
+
+    def embed_query(self, text):
+        """Embed a query, reusing the vector for text seen before."""
+        return list(self._embed_query_cached(text))
+
+    async def _embed_batch(self, client: httpx.AsyncClient, semaphore, batch):
+        """Embed one batch, falling back to per-text requests on old servers."""
+        async with semaphore:
+            res = await client.post(
+                f"{self.base_url}/api/embed",
+                json={"model": self.model, "input": batch, **self._default_params},
+            )
+        if res.status_code == 404:
+            # Servers that predate /api/embed only have /api/embeddings
+            return await asyncio.to_thread(self._embed, batch)
+        if res.status_code != 200:
+            raise ValueError(
+                "Error raised by inference API HTTP code: %s, %s"
+                % (res.status_code, res.text)
+            )
+        vectors = res.json().get("embeddings")
+        if vectors is None:
+            return await asyncio.to_thread(self._embed, batch)
+        return vectors
+
+    async def _embed_all(self, texts):
+        """Embed all texts with concurrent batched requests, preserving order."""
+        limits = httpx.Limits(
+            max_keepalive_connections=40,
+            max_connections=100,
+            keepalive_expiry=30.0
+        )
+        semaphore = asyncio.Semaphore(max(1, self.max_concurrency))
+        async with httpx.AsyncClient(limits=limits, http2=True, timeout=300) as client:
+            batches = [
+                texts[i:i + self.batch_size]
+                for i in range(0, len(texts), self.batch_size)
+            ]
+            results = await asyncio.gather(
+                *[self._embed_batch(client, semaphore, batch) for batch in batches]
+            )
+        return [vector for vectors in results for vector in vectors]
+
+    def embed_documents(self, texts):
+        """Embed documents in concurrent batches of batch_size texts."""
+        if not texts:
+            return []
+        instruction_pairs = [f"{self.embed_instruction}{text}" for text in texts]
+        return asyncio.run(self._embed_all(instruction_pairs))
+
+
+class BinaryRescoreIndex:
+    """Two-stage index: Hamming search over 1-bit codes, then int8 rescoring.
+
+    Each vector is kept twice in compact form: sign bits packed into a Faiss
+    IndexBinaryFlat (popcount distance, 32x smaller than fp32) and an int8 copy
+    scaled per dimension to the corpus range. A query first pulls
+    k * rescore_multiplier candidates from the binary index, which are then
+    reordered by the fp32 query against their int8 vectors.
+    """
+
+    BINARY_INDEX_FILE = "index.binary"
+    INT8_FILE = "rescore_int8.npz"
+
+    def __init__(self, binary_index, int8_vectors, starts, steps):
+        self.binary_index = binary_index
+        self.int8_vectors = int8_vectors
+        self.starts = starts
+        self.steps = steps
+
+    @classmethod
+    def from_vectors(cls, vectors):
+        """Calibrate the int8 ranges on vectors and index them."""
+        starts = vectors.min(axis=0)
+        steps = (vectors.max(axis=0) - starts) / 255
+        steps[steps == 0] = 1.0
+        rescore_index = cls(
+            faiss.IndexBinaryFlat(vectors.shape[1]),
+            np.empty((0, vectors.shape[1]), dtype=np.int8),
+            starts,
+            steps
+        )
+        rescore_index.add(vectors)
+        return rescore_index
+
+    def add(self, vectors):
+        """Append fp32 vectors, reusing the existing int8 calibration."""
+        self.binary_index.add(np.packbits(vectors > 0, axis=-1))
+        int8_vectors = np.clip(np.round((vectors - self.starts) / self.steps) - 128, -128, 127)
+        self.int8_vectors = np.vstack([self.int8_vectors, int8_vectors.astype(np.int8)])
+
+    def search(self, query, k, rescore_multiplier=4):
+        """Return the ids of the k best vectors for an fp32 query."""
+        query = np.asarray(query, dtype=np.float32).reshape(1, -1)
+        _, ids = self.binary_index.search(np.packbits(query > 0, axis=-1), k * rescore_multiplier)
+        ids = ids[0][ids[0] != -1]
+        # Dequantized vectors are starts + (code + 128) * steps; every term except
+        # (query * steps) . code is the same for all candidates, so rank by that.
+        scores = self.int8_vectors[ids].astype(np.float32) @ (query[0] * self.steps)
+        return ids[np.argsort(-scores)[:k]].tolist()
+
+    def save(self, folder_path):
+        faiss.write_index_binary(self.binary_index, os.path.join(folder_path, self.BINARY_INDEX_FILE))
+        np.savez(
+            os.path.join(folder_path, self.INT8_FILE),
+            int8_vectors=self.int8_vectors,
+            starts=self.starts,
+            steps=self.steps
+        )
+
+    @classmethod
+    def load(cls, folder_path):
+        """Load a saved index, or return None if the folder has none."""
+        binary_path = os.path.join(folder_path, cls.BINARY_INDEX_FILE)
+        int8_path = os.path.join(folder_path, cls.INT8_FILE)
+        if not (os.path.exists(binary_path) and os.path.exists(int8_path)):
+            return None
+        arrays = np.load(int8_path)
+        return cls(
+            faiss.read_index_binary(binary_path),
+            arrays["int8_vectors"],
+            arrays["starts"],
+            arrays["steps"]
+        )
+
+
+class BinaryRescoreRetriever(BaseRetriever):
+    """Retriever that searches a BinaryRescoreIndex instead of the Faiss index."""
+
+    vector_store: FAISS
+    rescore_index: BinaryRescoreIndex
+    k: int = 1
+    rescore_multiplier: int = 4
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        query_vector = self.vector_store.embedding_function.embed_query(query)
+        ids = self.rescore_index.search(query_vector, self.k, self.rescore_multiplier)
+        return [
+            self.vector_store.docstore.search(self.vector_store.index_to_docstore_id[i])
+            for i in ids
+        ]
 
 
 class RAGAgent:
@@ -38,9 +291,25 @@ class RAGAgent:
             getattr(config, "OLLAMA_BASE_URL", "http://localhost:11434")
         )
         self.vector_store = None
-        self.qa_chain = None
-        safe_embeddings_name = self.embeddings_model.replace(":", "_")
-        self.faiss_index_path = os.path.join(docs_dir, f"faiss_index_{safe_embeddings_name}")
+        self.rescore_index = None
+        self._index_mmapped = False
+        self._text_splitter = None
+        # Answers keyed by normalized question; cleared whenever the index changes.
+        # Flask serves requests on several threads, so access goes through a lock.
+        self._answer_cache = {}
+        self._answer_cache_lock = threading.Lock()
+        self.retriever = None
+        self._qa_chain = None
+        self.index_factory = getattr(config, "FAISS_INDEX_FACTORY", "HNSW32,SQfp16")
+        self.safe_embeddings_name = self.embeddings_model.replace(":", "_")
+        # Created once and reused by rebuilds, so the query client and its
+        # cached query vectors survive re-initialization
+        self.embeddings = self._create_embeddings()
+        # Index layout is part of the cache key so changing the factory forces a rebuild
+        safe_factory_name = re.sub(r"[^0-9a-zA-Z]+", "_", self.index_factory).strip("_").lower()
+        self.faiss_index_path = os.path.join(
+            docs_dir, f"faiss_index_{self.safe_embeddings_name}_{safe_factory_name}"
+        )
         
         # Create documents directory if it doesn't exist
         if not os.path.exists(docs_dir):
@@ -51,58 +320,36 @@ class RAGAgent:
     def _initialize_agent(self):
         """Initialize the RAG agent with documents and Ollama LLM"""
         try:
-            # Initialize embeddings (needed for loading or creating vector store)
-            # Use dedicated embeddings model for faster processing
-            embeddings = OllamaEmbeddings(
-                model=self.embeddings_model,
-                base_url=self.base_url
-            )
+            embeddings = self.embeddings
             
             # Try to load existing vector store
             if os.path.exists(self.faiss_index_path):
                 print("⚡ Loading cached vector store...")
-                self.vector_store = FAISS.load_local(
-                    self.faiss_index_path, 
-                    embeddings
-                )
+                self.vector_store = self._load_vector_store(embeddings)
                 print("✅ Vector store loaded from cache")
             else:
                 # Create new vector store
                 print("📚 Creating new vector store...")
                 
                 # Load documents from the documents directory
-                text_loader = DirectoryLoader(
-                    self.docs_dir,
-                    glob="**/*.txt",
-                    loader_cls=TextLoader
-                )
-                pdf_loader = DirectoryLoader(
-                    self.docs_dir,
-                    glob="**/*.pdf",
-                    loader_cls=PyPDFLoader
-                )
-                documents = text_loader.load() + pdf_loader.load()
+                documents = self._load_documents()
                 
                 if not documents:
                     print(f"Warning: No documents found in {self.docs_dir}")
                     # Create a sample document for testing
                     self._create_sample_document()
-                    documents = text_loader.load() + pdf_loader.load()
+                    documents = self._load_documents()
                 
                 # Split documents into chunks
-                text_splitter = RecursiveCharacterTextSplitter(
-                    chunk_size=700,  # Smaller chunks = faster embeddings
-                    chunk_overlap=20   # Reduced overlap = fewer chunks
-                )
-                docs = text_splitter.split_documents(documents)
+                docs = self.text_splitter.split_documents(documents)
                 
                 # Create embeddings and vector store
                 print("Creating embeddings (this may take a minute)...")
-                self.vector_store = FAISS.from_documents(docs, embeddings)
+                self.vector_store = self._build_vector_store(docs, embeddings)
                 
                 # Save the vector store for next time
                 print("💾 Saving vector store to cache...")
-                self.vector_store.save_local(self.faiss_index_path)
+                self._save_vector_store()
                 print("✅ Vector store cached")
             
             # Initialize LLM
@@ -126,16 +373,14 @@ Answer concisely:"""
                 template=prompt_template,
                 input_variables=["context", "question"]
             )
+            self.prompt = PROMPT
+            # query_stream formats with the plain str.format bound once here,
+            # skipping PromptTemplate's validation and plumbing on every query
+            self._format_prompt = prompt_template.format
+            self.retriever = self._create_retriever()
+            self._qa_chain = None
             
-            # Create QA chain
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=llm,
-                chain_type="stuff",
-                retriever=self.vector_store.as_retriever(search_kwargs={"k": 1}),  # Reduced to 1 for faster responses
-                chain_type_kwargs={"prompt": PROMPT},
-                return_source_documents=True
-            )
-            
+            self._warm_up_llm()
             print("✅ RAG Agent initialized successfully!")
             
         except Exception as e:
@@ -148,15 +393,329 @@ Answer concisely:"""
                 print(f"And model is installed: ollama pull {self.model_name}")
             raise
 
+    def _create_embeddings(self):
+        """Create the embeddings used for loading, building and querying the index."""
+        # Use dedicated embeddings model for faster processing
+        embeddings = BatchedOllamaEmbeddings(
+            model=self.embeddings_model,
+            base_url=self.base_url,
+            batch_size=getattr(config, "EMBED_BATCH_SIZE", 64),
+            max_concurrency=getattr(config, "OLLAMA_NUM_PARALLEL", 8),
+            query_cache_size=getattr(config, "QUERY_CACHE_SIZE", 1024)
+        )
+        # Chunk vectors are stored on disk keyed by a hash of the chunk text,
+        # so rebuilding the index only embeds chunks that changed
+        return CacheBackedEmbeddings.from_bytes_store(
+            embeddings,
+            LocalFileStore(os.path.join(self.docs_dir, ".emb_cache")),
+            # LocalFileStore keys reject ":", which Ollama model tags contain
+            namespace=self.safe_embeddings_name
+        )
+
+    @property
+    def qa_chain(self):
+        """RetrievalQA chain used by query(), built on first use.
+
+        query_stream does not need it, so the app never imports RetrievalQA.
+        """
+        if self._qa_chain is None and self.retriever is not None:
+            from langchain.chains import RetrievalQA
+            self._qa_chain = RetrievalQA.from_chain_type(
+                llm=self.llm,
+                chain_type="stuff",
+                retriever=self.retriever,
+                chain_type_kwargs={"prompt": self.prompt},
+                return_source_documents=True
+            )
+        return self._qa_chain
+
+    @property
+    def text_splitter(self):
+        """Splitter shared by full builds and add_document, created on first use.
+
+        A cached index never needs it, so startup skips loading the tokenizer.
+        """
+        if self._text_splitter is None:
+            self._text_splitter = self._create_text_splitter()
+        return self._text_splitter
+
+    def _create_text_splitter(self):
+        """Create the splitter used for both full builds and added documents.
+
+        Chunks are measured in tokens of SPLITTER_TOKENIZER so their size
+        tracks the embedding model's context. Without transformers or the
+        tokenizer files, chunks fall back to character counts.
+        """
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+        tokenizer_name = getattr(config, "SPLITTER_TOKENIZER", "BAAI/bge-small-en")
+        try:
+            from transformers import AutoTokenizer
+            tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        except (ImportError, OSError) as e:
+            print(f"⚠️  Tokenizer {tokenizer_name} unavailable ({type(e).__name__}), splitting by characters")
+            return RecursiveCharacterTextSplitter(
+                chunk_size=700,  # Smaller chunks = faster embeddings
+                chunk_overlap=20   # Reduced overlap = fewer chunks
+            )
+        return RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+            tokenizer,
+            chunk_size=getattr(config, "CHUNK_SIZE", 256),
+            chunk_overlap=getattr(config, "CHUNK_OVERLAP", 20)
+        )
+
+    def _load_documents(self):
+        """Load .txt files on a thread pool and PDFs on a process pool.
+
+        Text loading is I/O-bound; PDF parsing is CPU-bound, so each file is
+        parsed in its own process. Workers receive paths, not loader objects.
+        The pool always forks: spawn/forkserver workers re-import __main__,
+        and app.py builds an agent at import time. Forking is only safe while
+        this is the only thread, since a child can inherit a lock another
+        thread holds. So rebuilds from a Flask request thread, or platforms
+        without fork, parse PDFs serially.
+        """
+        txt_paths = sorted(glob.glob(os.path.join(self.docs_dir, "**", "*.txt"), recursive=True))
+        pdf_paths = sorted(glob.glob(os.path.join(self.docs_dir, "**", "*.pdf"), recursive=True))
+
+        documents = []
+        with ThreadPoolExecutor() as pool:
+            for docs in pool.map(_load_text, txt_paths):
+                documents.extend(docs)
+        can_fork = (
+            "fork" in multiprocessing.get_all_start_methods()
+            and threading.active_count() == 1
+        )
+        if len(pdf_paths) > 1 and can_fork:
+            with ProcessPoolExecutor(
+                max_workers=min(os.cpu_count() or 1, len(pdf_paths)),
+                mp_context=multiprocessing.get_context("fork")
+            ) as pool:
+                for docs in pool.map(_load_pdf, pdf_paths):
+                    documents.extend(docs)
+        else:
+            for path in pdf_paths:
+                documents.extend(_load_pdf(path))
+        return documents
+
+    def _build_vector_store(self, docs, embeddings):
+        """Embed docs and index them in a cosine-similarity Faiss index.
+
+        The index is built from FAISS_INDEX_FACTORY (HNSW32,SQfp16 by default)
+        instead of LangChain's flat index, so queries traverse a graph rather
+        than scanning every chunk and vectors are stored as fp16.
+        """
+        texts = [doc.page_content for doc in docs]
+        vectors = np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+        faiss.normalize_L2(vectors)
+
+        # "{nlist}" in an IVF factory string is filled from FAISS_NLIST, or sqrt(N) if unset
+        nlist = getattr(config, "FAISS_NLIST", None) or max(1, int(math.sqrt(len(vectors))))
+        factory = self.index_factory.format(nlist=nlist)
+        index = faiss.index_factory(vectors.shape[1], factory, faiss.METRIC_INNER_PRODUCT)
+        hnsw = getattr(index, "hnsw", None)
+        if hnsw is not None:
+            hnsw.efConstruction = getattr(config, "HNSW_EF_CONSTRUCTION", 200)
+        if not index.is_trained:
+            # SQ8 and IVF layouts learn their encoding from the corpus
+            index.train(vectors)
+        index.add(vectors)
+        self._tune_index(index)
+        self._index_mmapped = False
+        self.rescore_index = None
+        if getattr(config, "BINARY_RESCORE", False) and vectors.shape[1] % 8 == 0:
+            self.rescore_index = BinaryRescoreIndex.from_vectors(vectors)
+
+        ids = [str(uuid.uuid4()) for _ in docs]
+        docstore = InMemoryDocstore(dict(zip(ids, docs)))
+        return self._wrap_index(index, docstore, dict(enumerate(ids)), embeddings)
+
+    def _add_to_vector_store(self, docs):
+        """Embed docs and append them to the current index, leaving existing vectors as they are."""
+        if self._index_mmapped:
+            # A read-only mapping cannot grow, so load a private copy before adding
+            index = faiss.read_index(os.path.join(self.faiss_index_path, "index.faiss"))
+            self._tune_index(index)
+            self.vector_store.index = index
+            self._index_mmapped = False
+
+        texts = [doc.page_content for doc in docs]
+        vectors = np.asarray(
+            self.vector_store.embedding_function.embed_documents(texts), dtype=np.float32
+        )
+        faiss.normalize_L2(vectors)
+        self.vector_store.add_embeddings(
+            list(zip(texts, vectors.tolist())),
+            metadatas=[doc.metadata for doc in docs]
+        )
+        if self.rescore_index is not None:
+            self.rescore_index.add(vectors)
+
+    def _save_vector_store(self):
+        """Write the index, docstore and rescore data to faiss_index_path."""
+        self.vector_store.save_local(self.faiss_index_path)
+        if self.rescore_index is not None:
+            self.rescore_index.save(self.faiss_index_path)
+
+    def _load_vector_store(self, embeddings):
+        """Load the cached Faiss index and docstore written by save_local.
+
+        The stored vector codes are memory-mapped read-only instead of copied
+        into RAM: IVF inverted lists via IO_FLAG_MMAP, and the flat code storage
+        of HNSW and Flat layouts via IO_FLAG_MMAP_IFC (plain IO_FLAG_MMAP has no
+        effect on those). The OS pages codes in as searches touch them; HNSW
+        graph links are still read into memory.
+        """
+        mmap_flag = faiss.IO_FLAG_MMAP if "IVF" in self.index_factory.upper() else faiss.IO_FLAG_MMAP_IFC
+        index = faiss.read_index(
+            os.path.join(self.faiss_index_path, "index.faiss"),
+            mmap_flag | faiss.IO_FLAG_READ_ONLY
+        )
+        self._index_mmapped = True
+        self._tune_index(index)
+        with open(os.path.join(self.faiss_index_path, "index.pkl"), "rb") as f:
+            docstore, index_to_docstore_id = pickle.load(f)
+        self.rescore_index = None
+        if getattr(config, "BINARY_RESCORE", False):
+            self.rescore_index = self._load_rescore_index(index)
+        return self._wrap_index(index, docstore, index_to_docstore_id, embeddings)
+
+    def _load_rescore_index(self, index):
+        """Load the saved rescore index, or rebuild it from the Faiss index.
+
+        The saved copy is rebuilt when it is missing or out of date, e.g. when
+        BINARY_RESCORE was off while documents were added.
+        """
+        if index.d % 8 != 0:
+            return None
+        rescore_index = BinaryRescoreIndex.load(self.faiss_index_path)
+        if rescore_index is not None and rescore_index.binary_index.ntotal == index.ntotal:
+            return rescore_index
+
+        print("🔧 Building binary rescore index from the cached vectors...")
+        vectors = index.reconstruct_n(0, index.ntotal)
+        faiss.normalize_L2(vectors)
+        rescore_index = BinaryRescoreIndex.from_vectors(vectors)
+        rescore_index.save(self.faiss_index_path)
+        return rescore_index
+
+    def _warm_up_llm(self):
+        """Generate one token so Ollama loads the model now, not on the first query."""
+        print("🔥 Warming up LLM...")
+        try:
+            self.llm.invoke("warmup", stop=["\n"], num_predict=1)
+        except Exception as e:
+            print(f"⚠️  LLM warm-up failed, the first query may be slow: {e}")
+
+    def _create_retriever(self):
+        """Use the binary/int8 two-stage search when enabled, else Faiss search.
+
+        Faiss search defaults to MMR: fetch_k candidates are reranked for
+        diversity using vectors reconstructed from the index, so it costs no
+        extra embedding calls.
+        """
+        k = getattr(config, "SEARCH_K", 4)
+        if getattr(config, "BINARY_RESCORE", False):
+            if self.rescore_index is not None:
+                return BinaryRescoreRetriever(
+                    vector_store=self.vector_store,
+                    rescore_index=self.rescore_index,
+                    k=k,
+                    rescore_multiplier=getattr(config, "RESCORE_MULTIPLIER", 4)
+                )
+            print("⚠️  Embedding size is not a multiple of 8, binary rescoring disabled. Using Faiss search.")
+
+        search_type = getattr(config, "SEARCH_TYPE", "mmr")
+        search_kwargs = {"k": k}
+        if search_type == "mmr":
+            search_kwargs["fetch_k"] = getattr(config, "SEARCH_FETCH_K", 20)
+            search_kwargs["lambda_mult"] = getattr(config, "SEARCH_LAMBDA_MULT", 0.5)
+        return self.vector_store.as_retriever(search_type=search_type, search_kwargs=search_kwargs)
+
+    def _tune_index(self, index):
+        """Apply search-time parameters, which are not part of the index layout."""
+        hnsw = getattr(index, "hnsw", None)
+        if hnsw is not None:
+            hnsw.efSearch = getattr(config, "HNSW_EF_SEARCH", 64)
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            ivf.nprobe = getattr(config, "FAISS_NPROBE", 8)
+            # MMR reconstructs candidate vectors, which IVF only supports with a direct map
+            ivf.make_direct_map()
+
+    def _wrap_index(self, index, docstore, index_to_docstore_id, embeddings):
+        """Wrap a raw Faiss index so it keeps the FAISS.as_retriever API."""
+        with warnings.catch_warnings():
+            # LangChain warns that normalize_L2 does not apply to inner product,
+            # but normalizing the query is what makes inner product a cosine score.
+            warnings.simplefilter("ignore")
+            return FAISS(
+                embeddings,
+                index,
+                docstore,
+                index_to_docstore_id,
+                normalize_L2=True,
+                distance_strategy=DistanceStrategy.MAX_INNER_PRODUCT
+            )
+
     def _summarize_text(self, text: str, max_length: int) -> str:
-        """Summarize text to fit within max_length characters."""
+        """Shorten text to fit within max_length characters.
+
+        Runs the whole text through _trim_sentences, the same trimming
+        query_stream applies while the answer is generated.
+        """
         if not text or max_length <= 0:
             return ""
-        if len(text) <= max_length:
-            return text
-        if not getattr(self, "llm", None):
-            return text[:max_length].rstrip() + "..."
+        return "".join(self._trim_sentences([text], max_length))
+
+    def _trim_sentences(self, chunks, max_length: int):
+        """Yield text from chunks as whole sentences that fit within max_length.
+
+        Sentences are slices of the original text, so spacing and line breaks
+        between them are kept, which avoids a second LLM generation. Chunks
+        stop being consumed (and so generation stops) at the first sentence
+        that would cross the limit. If the first sentence alone does not fit,
+        it is cut off, or summarized by the LLM when over 1.5x the limit.
+        """
+        text = ""
+        kept = 0  # text[:kept] has been yielded
+        pos = 0   # where the next sentence starts
+        for chunk in chunks:
+            text += chunk
+            if not pos:
+                text = text.lstrip()
+            while (match := _sentence_end(text, pos)) is not None:
+                if match.start() > max_length:
+                    break
+                yield text[kept:match.start()]
+                kept, pos = match.start(), match.end()
+            else:
+                # No complete sentence left; keep going while the one in
+                # progress could still fit (or, for the first one, be summarized)
+                limit = max_length if kept else max_length * 1.5
+                if len(text.rstrip()) <= limit:
+                    continue
+            break
+        else:
+            end = len(text.rstrip())
+            if end <= max_length:
+                # A bare list number left at the end starts no sentence
+                if LIST_NUMBER.fullmatch(text, pos, end):
+                    end = kept
+                if end > kept:
+                    yield text[kept:end]
+                return
 
+        if not kept:
+            match = _sentence_end(text)
+            first_length = match.start() if match else len(text.rstrip())
+            if first_length > max_length * 1.5 and getattr(self, "llm", None):
+                yield self._summarize_with_llm(text, max_length)
+            else:
+                yield text[:max_length].rstrip() + "..."
+
+    def _summarize_with_llm(self, text: str, max_length: int) -> str:
+        """Ask the LLM to summarize text to at most max_length characters."""
         prompt = (
             "Summarize the following answer to be at most "
             f"{max_length} characters. Keep key facts and be concise.\n\n"
@@ -219,24 +778,98 @@ AI is transforming industries and society with both opportunities and challenges
             if not self.qa_chain:
                 return "Agent not properly initialized. Make sure Ollama is running."
 
+            cached = self._cached_answer(question)
+            if cached is not None:
+                return cached
+
             result = self.qa_chain.invoke({"query": question})
             answer = result.get("result", "No answer found")
             max_length = getattr(config, "MAX_RESPONSE_LENGTH", None) or 0
-            if max_length and len(answer) > max_length:
-                return self._summarize_text(answer, max_length)
+            if max_length:
+                answer = self._summarize_text(answer, max_length)
+            self._cache_answer(question, answer)
             return answer
 
         except Exception as e:
-            import traceback
-            print(f"❌ Query error: {type(e).__name__}: {e!r}")
-            traceback.print_exc()
-            if "Connection refused" in str(e) or "Max retries exceeded" in str(e):
-                return (
-                    "Error: Ollama is unreachable. Start it with `ollama serve` "
-                    "or set OLLAMA_BASE_URL to the correct endpoint."
-                )
-            return f"Error processing query: {type(e).__name__}: {str(e)}"
+            return self._query_error_message(e)
+
+    def query_stream(self, question: str):
+        """
+        Query the RAG agent, yielding the answer as the LLM generates it
+        
+        Args:
+            question: User question
+            
+        Yields:
+            Chunks of the response. With MAX_RESPONSE_LENGTH set, text is sent
+            a sentence at a time and generation stops before the sentence that
+            would cross the limit, trimmed the same way as query().
+
+        Raises:
+            QueryError: if the query fails, possibly after some chunks were sent
+        """
+        if not self.retriever:
+            raise QueryError("Agent not properly initialized. Make sure Ollama is running.")
+        try:
+
+            cached = self._cached_answer(question)
+            if cached is not None:
+                yield cached
+                return
+
+            docs = self.retriever.get_relevant_documents(question)
+            prompt = self._format_prompt(
+                context="\n\n".join(doc.page_content for doc in docs),
+                question=question
+            )
+            max_length = getattr(config, "MAX_RESPONSE_LENGTH", None) or 0
+            chunks = self.llm.stream(prompt)
+            if max_length:
+                chunks = self._trim_sentences(chunks, max_length)
+            answer = ""
+            for chunk in chunks:
+                answer += chunk
+                yield chunk
+            self._cache_answer(question, answer)
+
+        except Exception as e:
+            raise QueryError(self._query_error_message(e)) from e
+
+    def _query_error_message(self, e: Exception) -> str:
+        """Log a query failure and turn it into a message for the user."""
+        import traceback
+        print(f"❌ Query error: {type(e).__name__}: {e!r}")
+        traceback.print_exc()
+        if "Connection refused" in str(e) or "Max retries exceeded" in str(e):
+            return (
+                "Error: Ollama is unreachable. Start it with `ollama serve` "
+                "or set OLLAMA_BASE_URL to the correct endpoint."
+            )
+        return f"Error processing query: {type(e).__name__}: {str(e)}"
     
+    @staticmethod
+    def _answer_cache_key(question: str) -> str:
+        return question.strip().lower()
+
+    def _cached_answer(self, question: str):
+        """Return the cached answer for question, or None if it is not cached."""
+        with self._answer_cache_lock:
+            return self._answer_cache.get(self._answer_cache_key(question))
+
+    def _cache_answer(self, question: str, answer: str):
+        """Store an answer, evicting the oldest entry once the cache is full."""
+        max_size = getattr(config, "ANSWER_CACHE_SIZE", 1024)
+        if max_size <= 0:
+            return
+        with self._answer_cache_lock:
+            if len(self._answer_cache) >= max_size:
+                self._answer_cache.pop(next(iter(self._answer_cache)))
+            self._answer_cache[self._answer_cache_key(question)] = answer
+
+    def _clear_answer_cache(self):
+        with self._answer_cache_lock:
+            self._answer_cache.clear()
+
     def add_document(self, content: str, filename: str = None) -> bool:
         """
         Add a new document to the knowledge base
@@ -254,16 +887,31 @@ AI is transforming industries and society with both opportunities and challenges
                 filename = f"document_{int(time.time())}.txt"
             
             filepath = os.path.join(self.docs_dir, filename)
-            with open(filepath, "w") as f:
-                f.write(content)
-            
-            # Remove cached index to force rebuild
-            if os.path.exists(self.faiss_index_path):
+            if os.path.exists(filepath):
+                with open(filepath, "w") as f:
+                    f.write(content)
+                # HNSW cannot remove the old version's chunks, so re-index everything
+                return self.rebuild_index()
+
+            # Embed only the new document's chunks and append them to the index.
+            # The file is written afterwards, so if embedding fails (e.g. Ollama
+            # is down) neither docs_dir nor the cached index has changed.
+            docs = self.text_splitter.split_documents(
+                [Document(page_content=content, metadata={"source": filepath})]
+            )
+            self._add_to_vector_store(docs)
+            try:
+                with open(filepath, "w") as f:
+                    f.write(content)
+                self._save_vector_store()
+            except Exception:
+                # The cached index no longer matches docs_dir; drop it so the
+                # next start rebuilds it from the documents on disk
                 import shutil
-                shutil.rmtree(self.faiss_index_path)
-            
-            # Reinitialize agent to include new document
-            self._initialize_agent()
+                shutil.rmtree(self.faiss_index_path, ignore_errors=True)
+                raise
+            # Cleared after the update so a concurrent query cannot re-cache a stale answer
+            self._clear_answer_cache()
             return True
         
         except Exception as e:
@@ -277,6 +925,7 @@ AI is transforming industries and society with both opportunities and challenges
                 import shutil
                 shutil.rmtree(self.faiss_index_path)
             self._initialize_agent()
+            self._clear_answer_cache()
             print("✅ Index rebuilt successfully")
             return True
         except Exception as e:
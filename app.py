@@ -1,6 +1,6 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
 import os
-from agent import RAGAgent
+from agent import QueryError, RAGAgent
 import config
 
 app = Flask(__name__)
@@ -13,6 +13,12 @@ rag_agent = RAGAgent(
     base_url=config.OLLAMA_BASE_URL
 )
 
+def sse_event(data, event=None):
+    """Format one Server-Sent Event; multi-line data becomes several data: lines."""
+    lines = [f"event: {event}"] if event else []
+    lines += [f"data: {line}" for line in data.split("\n")]
+    return "\n".join(lines) + "\n\n"
+
 # Routes
 @app.route("/")
 def index():
@@ -36,10 +42,20 @@ def query_agent():
         
         print(f"\n🔍 Query: {query}")
         print("⏳ Processing (this may take a minute)...")
-        response = rag_agent.query(query)
-        print(f"✅ Response: {response[:100]}...\n")
-        
-        return jsonify({'response': response}), 200
+
+        def generate():
+            response = ""
+            try:
+                for chunk in rag_agent.query_stream(query):
+                    response += chunk
+                    yield sse_event(chunk)
+            except QueryError as e:
+                yield sse_event(str(e), event="error")
+            else:
+                print(f"✅ Response: {response[:100]}...\n")
+            yield sse_event("", event="done")
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream')
         
     except Exception as e:
         print(f"❌ Error: {str(e)}")
@@ -7,14 +7,45 @@ Customize settings here
 LLM_MODEL = "llama3"  # Model to use: llama3 (efficient and capable), phi3:mini (fast), mistral (slow but accurate), llama2, neural-chat
 EMBEDDINGS_MODEL = "nomic-embed-text"  # Model for embeddings (fast, optimized for this task)
 OLLAMA_BASE_URL = "http://localhost:11434"
+EMBED_BATCH_SIZE = 64  # Texts per /api/embed request when indexing documents
+# Concurrent embedding requests sent to Ollama. Start the server with a matching
+# OLLAMA_NUM_PARALLEL=8 so the requests are actually served in parallel; chat
+# requests, each on its own Flask thread, then also decode side by side.
+OLLAMA_NUM_PARALLEL = 8
+# The agent loads the LLM with a 1-token warm-up at startup. Ollama unloads idle
+# models after 5 minutes; start the server with OLLAMA_KEEP_ALIVE=1h to keep it resident.
 
 # Document Settings
 DOCUMENTS_DIR = "documents"
-CHUNK_SIZE = 500
-CHUNK_OVERLAP = 100
+SPLITTER_TOKENIZER = "BAAI/bge-small-en"  # Hugging Face tokenizer used to measure chunk length
+CHUNK_SIZE = 256  # Tokens per chunk
+CHUNK_OVERLAP = 20  # Tokens shared between neighbouring chunks
+
+# Vector Index Settings
+# Faiss index_factory string. SQfp16 stores vectors as fp16 (2x smaller than fp32,
+# no recall loss on unit-norm embeddings, no training). "HNSW32,SQ8" is 4x smaller
+# but calibrates its int8 range on the first build, so documents added later can
+# be clipped. "HNSW32" keeps fp32 vectors, "Flat" does exact search and
+# "IVF256,SQ8" needs at least 256 chunks to train. For mid-size corpora (thousands
+# to millions of chunks) "IVF{nlist},Flat" partitions vectors into nlist clusters
+# and only scans FAISS_NPROBE of them per query.
+FAISS_INDEX_FACTORY = "HNSW32,SQfp16"
+HNSW_EF_CONSTRUCTION = 200  # Graph build quality (higher = better recall, slower indexing)
+HNSW_EF_SEARCH = 64  # Candidates visited per query (higher = better recall, slower search)
+FAISS_NLIST = None  # IVF clusters; None = sqrt(number of chunks)
+FAISS_NPROBE = 8  # IVF clusters scanned per query (higher = better recall, slower search)
+# Two-stage retrieval: Hamming search over 1-bit codes for k * RESCORE_MULTIPLIER
+# candidates, then rescoring with int8 vectors. Worth enabling for large corpora.
+BINARY_RESCORE = False
+RESCORE_MULTIPLIER = 4
 
 # Search Settings
-SEARCH_K = 3  # Number of documents to retrieve for each query
+SEARCH_K = 4  # Number of documents to retrieve for each query
+# "mmr" picks SEARCH_K diverse chunks out of the SEARCH_FETCH_K nearest, so the
+# prompt carries less duplicate context; "similarity" takes the SEARCH_K nearest.
+SEARCH_TYPE = "mmr"
+SEARCH_FETCH_K = 20
+SEARCH_LAMBDA_MULT = 0.5  # 1 = pure relevance, 0 = maximum diversity
 
 # Flask Settings
 FLASK_ENV = "development"
@@ -26,3 +57,7 @@ DATABASE_URL = "sqlite:///users.db"
 # RAG Settings
 USE_SOURCE_DOCUMENTS = True  # Show source documents in responses
 MAX_RESPONSE_LENGTH = 700  # Maximum response length
+
+# Cache Settings
+QUERY_CACHE_SIZE = 1024  # Query embeddings kept in memory (LRU)
+ANSWER_CACHE_SIZE = 1024  # Answers kept per normalized question; cleared when documents change
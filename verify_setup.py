@@ -6,7 +6,9 @@ Run this to check if everything is configured correctly
 
 import os
 import sys
-import subprocess
+import urllib.error
+import urllib.request
+from importlib.metadata import PackageNotFoundError, distribution
 
 def check_python():
     """Check Python version"""
@@ -21,18 +23,19 @@ def check_ollama():
     """Check if Ollama is running"""
     print("\n🔍 Checking Ollama connection...")
     try:
-        response = subprocess.run(
-            ['curl', '-s', 'http://localhost:11434/api/tags'],
-            capture_output=True,
-            timeout=2
-        )
-        if response.returncode == 0:
+        with urllib.request.urlopen('http://localhost:11434/api/tags', timeout=2) as response:
+            status = response.status
+        if status == 200:
             print("✅ Ollama is running on localhost:11434")
             return True
         else:
             print("❌ Ollama is not responding")
             print("   → Run: ollama serve")
             return False
+    except urllib.error.HTTPError:
+        print("❌ Ollama is not responding")
+        print("   → Run: ollama serve")
+        return False
     except Exception as e:
         print("❌ Ollama is not running")
         print("   → Make sure to run: ollama serve")
@@ -63,10 +66,12 @@ def check_dependencies():
     required = ['flask', 'flask_sqlalchemy', 'flask_login', 'langchain', 'chromadb', 'ollama']
     missing = []
     
+    # Look up installed distributions rather than importing them; importing
+    # langchain or chromadb alone takes seconds.
     for pkg in required:
         try:
-            __import__(pkg)
-        except ImportError:
+            distribution(pkg)
+        except PackageNotFoundError:
             missing.append(pkg)
     
     if missing: